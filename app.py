@@ -1,14 +1,37 @@
 import os
+import re
 import markdown
 import json 
+import orjson
+import hashlib
+import hmac
+import socket
+import httpx
+import redis
+import threading
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from types import MappingProxyType
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, Response, g, render_template, request, redirect, url_for, flash, session, jsonify, make_response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
+from flask_session import Session
+from flask_compress import Compress
 from openai import OpenAI
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import event, insert, inspect, select, text
+from sqlalchemy.exc import IntegrityError, OperationalError, SQLAlchemyError
+from sqlalchemy.orm import joinedload, make_transient_to_detached, raiseload
+from sqlalchemy.pool import StaticPool
 from datetime import datetime, time, date
+try:
+    import tiktoken
+except ImportError:  # optional: exact token counts for the chat history budget
+    tiktoken = None
+from time import monotonic
 
 # --- App Initialization ---
 load_dotenv()
@@ -20,21 +43,181 @@ app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'a_very_strong_def
 instance_path = os.path.join(app.instance_path)
 os.makedirs(instance_path, exist_ok=True)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(instance_path, 'medconnect.db')
+# A warm pool sized for gunicorn's threads; pre-ping drops connections the server closed while idle,
+# and recycling under 5 minutes stays ahead of hosted Postgres idle-connection timeouts
+engine_options = {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 30, 'pool_pre_ping': True, 'pool_recycle': 280}
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    engine_options['connect_args'] = {'check_same_thread': False, 'timeout': 5.0}
+    if app.config['SQLALCHEMY_DATABASE_URI'] in ('sqlite://', 'sqlite:///:memory:'):
+        # An in-memory database only exists on its one connection, so every thread must share it
+        engine_options = {'poolclass': StaticPool, 'connect_args': engine_options['connect_args']}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+# bcrypt cost for new password hashes. 12 is Flask-Bcrypt's default, which every existing
+# account was hashed with; the dummy hash for unknown emails must cost the same, or login
+# timing would reveal which emails have accounts.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+# Compress HTML/JSON responses, but never the /ask_stream event stream, which must reach the browser chunk by chunk
+app.config['COMPRESS_STREAMS'] = False
+# Keep sessions server-side in Redis when it's available, so the browser only carries a session id
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    app.config['SESSION_TYPE'] = 'redis'
+    app.config['SESSION_REDIS'] = redis.Redis.from_url(REDIS_URL)
+
+# --- JSON Provider ---
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider (jsonify, request.json, the session cookie) backed by orjson.
+
+    Types orjson can't encode itself (e.g. Decimal) go through Flask's default handling.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+app.json = ORJSONProvider(app)
 
 # --- Extensions ---
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
+# Checked against when the email doesn't exist, so a failed login costs the same either way
+DUMMY_PASSWORD_HASH = bcrypt.generate_password_hash('not-a-real-password').decode('utf-8')
+Compress(app)
+if REDIS_URL:
+    Session(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'landing' 
 login_manager.login_message = 'Please log in or sign up to access the app.'
 login_manager.login_message_category = 'info' 
 
+# --- SQLite Tuning ---
+# WAL lets /get_history reads run while /ask is writing, and synchronous=NORMAL
+# avoids an fsync on every commit. Skipped when DATABASE_URL points at Postgres.
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        @event.listens_for(db.engine, "connect")
+        def _set_sqlite_pragmas(dbapi_conn, _connection_record):
+            cursor = dbapi_conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=5000")
+            cursor.execute("PRAGMA cache_size=-32000")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA mmap_size=268435456")
+            # Truncate the WAL back to 64 MB after checkpoints instead of letting it keep its peak size
+            cursor.execute("PRAGMA journal_size_limit=67108864")
+            cursor.close()
+
 # --- OpenRouter AI Client ---
+# Built on first use in each worker (not at import, which runs in gunicorn's master when
+# preloading) and then shared, so every request reuses the same keep-alive connection pool.
 OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY')
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=OPENROUTER_API_KEY,
-)
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+OPENROUTER_TIMEOUT_SECONDS = 30.0
+_client = None
+_http_client = None
+_client_lock = threading.Lock()
+
+def get_openrouter_client():
+    """Returns the shared OpenAI client for OpenRouter, or None if no API key is configured."""
+    global _client, _http_client
+    if _client is None and OPENROUTER_API_KEY:
+        with _client_lock:
+            if _client is None:
+                _http_client = httpx.Client(
+                    # TCP_NODELAY so small streamed chunks aren't held back by Nagle's algorithm
+                    transport=httpx.HTTPTransport(
+                        http2=True,
+                        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=30.0),
+                        socket_options=[(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)],
+                    ),
+                    timeout=httpx.Timeout(OPENROUTER_TIMEOUT_SECONDS, connect=5.0),
+                )
+                _client = OpenAI(
+                    base_url=OPENROUTER_BASE_URL,
+                    api_key=OPENROUTER_API_KEY,
+                    http_client=_http_client,
+                    max_retries=2,
+                )
+    return _client
+
+def _drop_openrouter_client_after_fork():
+    # A client built before a fork would share its sockets with the parent; give the child
+    # a fresh one on first use. Not closed here, since that would close the parent's connections.
+    global _client, _http_client, _client_lock
+    _client = None
+    _http_client = None
+    _client_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_drop_openrouter_client_after_fork)
+
+def warm_up_openrouter():
+    """Builds the client and opens a pooled connection so the first /ask doesn't pay the TCP+TLS handshake.
+
+    Called per worker from gunicorn's post_fork hook; connections opened before the fork
+    would be shared between workers.
+    """
+    if get_openrouter_client() is None:
+        return
+    try:
+        _http_client.head(OPENROUTER_BASE_URL + "/models")
+    except httpx.HTTPError as e:
+        app.logger.warning(f"Could not warm up OpenRouter connection: {e}")
+
+# Providers only reuse a cached prompt prefix if the request lands on the same provider,
+# so a fixed provider order can be pinned here (comma-separated OpenRouter provider names).
+OPENROUTER_PROVIDER_ORDER = [p.strip() for p in os.environ.get('OPENROUTER_PROVIDER_ORDER', '').split(',') if p.strip()]
+OPENROUTER_EXTRA_BODY = {"provider": {"order": OPENROUTER_PROVIDER_ORDER}} if OPENROUTER_PROVIDER_ORDER else None
+
+# Sent first and byte-identical on every call so the provider can serve it from its prompt cache.
+# Don't interpolate per-user or per-request values into it. Read-only, since every request
+# and thread shares this one object.
+SYSTEM_PROMPT = MappingProxyType({
+    "role": "system",
+    "content": (
+        "You have two tasks. First, be a helpful medical AI. Second, be a reminder assistant."
+        "\n\n**TASK 1: Medical AI**"
+        "\n- **YOUR MOST IMPORTANT RULE:** You MUST refuse to answer any questions that are not related to health, medicine, wellness, or symptoms. "
+        "If the user asks about anything else, you must politely decline."
+        "\n- Your persona: You are 'Medullose AI'. You are NOT a doctor and must NEVER provide a diagnosis. "
+        "Always end your (health-related) response with a clear, friendly disclaimer: 'Please remember, I am an AI, not a medical professional. It's always best to consult a doctor for a proper diagnosis.'"
+        
+        "\n\n**TASK 2: Reminder Assistant**"
+        "\n- If the user asks to set a medicine reminder, your goal is to collect three pieces of information: `medicine_name`, `dosage` (optional), and `time` (in 24-hour HH:MM format)."
+        "\n- Ask for any missing information."
+        "\n- Once you have the required info, you **MUST** respond *only* with a special JSON-like string and nothing else."
+        "\n- **JSON Format:** `{\"action\": \"create_reminder\", \"medicine\": \"...\", \"dosage\": \"...\", \"time\": \"HH:MM\"}`"
+    )
+})
+
+# --- AI Response Cache ---
+# Identical conversations (same system prompt, history and question) reuse the
+# previous answer instead of calling OpenRouter again. A per-process LRU is always on;
+# Redis is added as a shared second tier when REDIS_URL is set.
+AI_CACHE_TTL_SECONDS = 24 * 60 * 60
+_local_ai_cache = TTLCache(maxsize=2048, ttl=AI_CACHE_TTL_SECONDS)
+_local_ai_cache_lock = threading.Lock()
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+
+# --- Markdown Rendering ---
+# Building a Markdown instance is much more expensive than converting with one, so each
+# thread keeps its own (instances are stateful and not safe to share between threads).
+_markdown_local = threading.local()
+
+# Output depends only on the text, so articles without stored HTML are parsed once per process
+@lru_cache(maxsize=256)
+def render_markdown(text):
+    md = getattr(_markdown_local, 'md', None)
+    if md is None:
+        md = _markdown_local.md = markdown.Markdown(extensions=['extra'], output_format='html')
+    return md.reset().convert(text)
 
 # --- Database Models ---
 
@@ -43,9 +226,9 @@ class User(db.Model, UserMixin):
     name = db.Column(db.String(150), nullable=False)
     email = db.Column(db.String(150), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
-    chat_history = db.relationship('ChatHistory', backref='author', lazy=True, cascade="all, delete-orphan")
-    reminders = db.relationship('Reminder', backref='author', lazy=True, cascade="all, delete-orphan")
-    appointments = db.relationship('Appointment', backref='patient', lazy=True, cascade="all, delete-orphan")
+    chat_history = db.relationship('ChatHistory', back_populates='author', lazy='select', cascade="all, delete-orphan")
+    reminders = db.relationship('Reminder', back_populates='author', lazy='select', cascade="all, delete-orphan")
+    appointments = db.relationship('Appointment', back_populates='patient', lazy='select', cascade="all, delete-orphan")
 
 class ChatHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -53,16 +236,30 @@ class ChatHistory(db.Model):
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Nothing reads a message's author; raise rather than silently SELECT per row if that changes
+    author = db.relationship('User', back_populates='chat_history', lazy='raise_on_sql')
+
+    # Also serves plain user_id lookups (e.g. clearing a chat), so user_id needs no index of its own
+    __table_args__ = (db.Index('ix_chat_user_id_id', 'user_id', 'id'),)
 
 class Article(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     category = db.Column(db.String(50), nullable=False)
     content_md = db.Column(db.Text, nullable=False)
+    # Markdown rendered once when the article is seeded, so requests don't re-parse it
+    _content_html = db.Column('content_html', db.Text, nullable=True)
     
     @property
     def content_html(self):
-        return markdown.markdown(self.content_md)
+        return self._content_html or render_markdown(self.content_md)
+
+@event.listens_for(Article, 'before_insert')
+@event.listens_for(Article, 'before_update')
+def _store_article_html(mapper, connection, article):
+    """Re-renders the stored HTML whenever an article's Markdown is written through the ORM."""
+    if article._content_html is None or inspect(article).attrs.content_md.history.has_changes():
+        article._content_html = render_markdown(article.content_md)
 
 class Reminder(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -70,6 +267,10 @@ class Reminder(db.Model):
     dosage = db.Column(db.String(50), nullable=True)
     reminder_time = db.Column(db.Time, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    author = db.relationship('User', back_populates='reminders', lazy='raise_on_sql')
+
+    # Lists a user's reminders in time order straight from the index; covers user_id lookups too
+    __table_args__ = (db.Index('ix_reminder_user_time', 'user_id', 'reminder_time'),)
     
     def to_dict(self):
         return {
@@ -87,7 +288,7 @@ class Doctor(db.Model):
     phone = db.Column(db.String(20), nullable=False)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
-    appointments = db.relationship('Appointment', backref='doctor', lazy=True)
+    appointments = db.relationship('Appointment', back_populates='doctor', lazy='select')
     
     def to_dict(self):
         return {
@@ -106,6 +307,10 @@ class Appointment(db.Model):
     reason = db.Column(db.String(300), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctor.id'), nullable=False)
+    patient = db.relationship('User', back_populates='appointments')
+    doctor = db.relationship('Doctor', back_populates='appointments')
+    # Serves My Appointments' filter on user_id and its ORDER BY from the index, with no sort step
+    __table_args__ = (db.Index('ix_appt_user_dt', 'user_id', 'appointment_datetime'),)
 
 
 # --- Database Initialization Functions ---
@@ -119,7 +324,7 @@ def _seed_data():
 
     # --- Full Article Content Added ---
     articles = [
-        Article(title="Understanding the Common Cold", category="Common Illness", content_md="""
+        dict(title="Understanding the Common Cold", category="Common Illness", content_md="""
 **What is a common cold?**
 The common cold is a viral infection of your nose and throat (upper respiratory tract). It's usually harmless, although it might not feel that way.
 
@@ -139,7 +344,7 @@ The common cold is a viral infection of your nose and throat (upper respiratory
 
 **Disclaimer:** This is for informational purposes only. Always consult a medical professional for diagnosis and treatment.
         """),
-        Article(title="First Aid for Minor Burns", category="First Aid", content_md="""
+        dict(title="First Aid for Minor Burns", category="First Aid", content_md="""
 **What is a minor burn?**
 A minor burn (first-degree or mild second-degree) is one that is small (less than 3 inches), superficial, and does not cover a major joint or sensitive area like the face.
 
@@ -156,7 +361,7 @@ A minor burn (first-degree or mild second-degree) is one that is small (less tha
 
 **Disclaimer:** Seek immediate medical attention for any burns that are large, deep, on the face/hands/feet/genitals, or caused by chemicals or electricity.
         """),
-        Article(title="What is a Fever?", category="Symptoms", content_md="""
+        dict(title="What is a Fever?", category="Symptoms", content_md="""
 **What is a fever?**
 A fever is a temporary increase in your body temperature, often due to an illness. A fever is a sign that something out of the ordinary is going on in your body. For an adult, a fever may be uncomfortable, but it usually isn't a cause for concern unless it reaches 103 F (39.4 C) or higher.
 
@@ -173,7 +378,7 @@ A fever is a temporary increase in your body temperature, often due to an illnes
 
 **Disclaimer:** While most fevers are harmless, you should consult a doctor if your fever is unusually high, lasts for more than a few days, or is accompanied by severe symptoms like a stiff neck, confusion, or difficulty breathing.
         """),
-        Article(title="The Importance of Handwashing", category="Wellness", content_md="""
+        dict(title="The Importance of Handwashing", category="Wellness", content_md="""
 **Why is handwashing important?**
 Handwashing is one of the easiest and most effective ways to prevent the spread of germs and stay healthy. Your hands touch many surfaces and can pick up germs, which can then be transferred to your eyes, nose, or mouth.
 
@@ -194,7 +399,7 @@ Handwashing is one of the easiest and most effective ways to prevent the spread
 
 **Disclaimer:** This is general health advice. Handwashing is a key part of hygiene but does not replace other medical advice.
         """),
-        Article(title="Understanding Mild Sprains", category="First Aid", content_md="""
+        dict(title="Understanding Mild Sprains", category="First Aid", content_md="""
 **What is a sprain?**
 A sprain is a stretching or tearing of ligaments — the tough bands of fibrous tissue that connect two bones in your joints. The most common location for a sprain is in your ankle.
 
@@ -213,7 +418,7 @@ For the first 24-48 hours, the best treatment for a mild sprain is the R.I.C.E.
 
 **Disclaimer:** Seek medical advice if you cannot put weight on the joint or if the pain and swelling are severe or do not improve after 2-3 days.
         """),
-        Article(title="Tips for a Healthy Diet", category="Wellness", content_md="""
+        dict(title="Tips for a Healthy Diet", category="Wellness", content_md="""
 **What is a healthy diet?**
 A healthy diet is one that helps to maintain or improve overall health. It provides the body with essential nutrition: fluid, macronutrients, micronutrients, and adequate calories.
 
@@ -226,7 +431,7 @@ A healthy diet is one that helps to maintain or improve overall health. It provi
 
 **Disclaimer:** This is general dietary advice. For specific nutritional needs, allergies, or health conditions, please consult a registered dietitian or medical professional.
         """),
-        Article(title="The Benefits of Regular Exercise", category="Wellness", content_md="""
+        dict(title="The Benefits of Regular Exercise", category="Wellness", content_md="""
 **Why exercise?**
 Regular physical activity is one of the most important things you can do for your health. It can help:
 - Control your weight
@@ -241,7 +446,7 @@ Aim for at least 150 minutes of moderate-intensity aerobic activity (like brisk
 
 **Disclaimer:** Before starting any new exercise program, it's important to consult with your doctor, especially if you have any pre-existing health conditions.
         """),
-        Article(title="Managing Stress", category="Wellness", content_md="""
+        dict(title="Managing Stress", category="Wellness", content_md="""
 **What is stress?**
 Stress is your body's reaction to a challenge or demand. In short bursts, stress can be positive, such as when it helps you avoid danger. But when stress lasts for a long time, it may harm your health.
 
@@ -255,7 +460,7 @@ Stress is your body's reaction to a challenge or demand. In short bursts, stress
 
 **Disclaimer:** If you are feeling overwhelmed by stress or it is impacting your daily life, please seek help from a qualified mental health professional.
         """),
-        Article(title="Understanding Dehydration", category="Symptoms", content_md="""
+        dict(title="Understanding Dehydration", category="Symptoms", content_md="""
 **What is dehydration?**
 Dehydration occurs when you lose more fluid than you take in, and your body doesn't have enough water and other fluids to carry out its normal functions.
 
@@ -274,7 +479,7 @@ Dehydration occurs when you lose more fluid than you take in, and your body does
 
 **Disclaimer:** Seek immediate medical attention if you experience severe dehydration symptoms, such as dizziness, confusion, fainting, or inability to keep fluids down.
         """),
-        Article(title="When to See a Doctor for a Cough", category="Symptoms", content_md="""
+        dict(title="When to See a Doctor for a Cough", category="Symptoms", content_md="""
 **Most coughs are not serious.**
 A cough is a common reflex action that clears your throat of mucus or foreign irritants. Most coughs are caused by the common cold or flu and will go away on their own.
 
@@ -289,57 +494,221 @@ You should see a medical professional if your cough:
 **Disclaimer:** This is not an exhaustive list. If you are ever concerned about a cough or any other symptom, it is always best to consult a medical professional for an accurate diagnosis and treatment.
         """)
     ]
-    db.session.bulk_save_objects(articles)
+    for article in articles:
+        article['_content_html'] = render_markdown(article['content_md'])
+    db.session.bulk_insert_mappings(Article, articles)
     
     # --- Add ALL 9 Sample Doctors ---
     doctors = [
-        Doctor(name="Jai Hind Clinic", specialty="Medical Clinic", 
+        dict(name="Jai Hind Clinic", specialty="Medical Clinic", 
                address="Nawabganj, durga mandir road, unnao Uttar Pradesh 209859", 
                phone="09169457354", latitude=26.6187, longitude=80.6712),
-        Doctor(name="SHASHWAT Dental Hospital Clinic", specialty="Dental Clinic", 
+        dict(name="SHASHWAT Dental Hospital Clinic", specialty="Dental Clinic", 
                address="block (kshtera panchayat, Nawabganj, Kanpur Rd, Unnao, Uttar Pradesh 209859", 
                phone="08090310358", latitude=26.6166, longitude=80.6725),
-        Doctor(name="Dr.Vineet Tiwari", specialty="General Physician", 
+        dict(name="Dr.Vineet Tiwari", specialty="General Physician", 
                address="Lucknow, Kanpur - Lucknow Rd, near shiv mandir, Mawaiyya, Lucknow, Uttar Pradesh 209859", 
                phone="09415518286", latitude=26.8143, longitude=80.8924),
-        Doctor(name="Shri Ram Murti Smarak Hospital", specialty="Hospital", 
+        dict(name="Shri Ram Murti Smarak Hospital", specialty="Hospital", 
                address="JJPGH+XG8, Allahabad Highway, Kanpur, Unnao, Ashakhera, Uttar Pradesh 209859", 
                phone="05143278408", latitude=26.6249, longitude=80.5788),
-        Doctor(name="Sanjay Gandhi Post Graduate Institute (SGPGI)", specialty="Multi-Specialty Institute",
+        dict(name="Sanjay Gandhi Post Graduate Institute (SGPGI)", specialty="Multi-Specialty Institute",
                address="Raebareli Road, Haibat Mau Mawaiya, Pushpendra Nagar, Lucknow, Uttar Pradesh, 226014",
                phone="0522-2494000", latitude=26.7588, longitude=80.9488),
-        Doctor(name="Medanta Super Speciality Hospital", specialty="Multi-Specialty Hospital",
+        dict(name="Medanta Super Speciality Hospital", specialty="Multi-Specialty Hospital",
                address="Sector - A, Pocket - 1, Amar Shaheed Path, Golf City, Lucknow, Uttar Pradesh, 226030",
                phone="+91 522 450 5050", latitude=26.7766, longitude=80.9885),
-        Doctor(name="Saraswati Medical College and Hospital", specialty="Medical College & Hospital",
+        dict(name="Saraswati Medical College and Hospital", specialty="Medical College & Hospital",
                address="LIDA, Madhu Vihar, P.O. Asha Khera, NH-27, Lucknow-Kanpur Highway, Unnao (UP), 209859",
                phone="0515-3510001", latitude=26.5866, longitude=80.6053),
-        Doctor(name="Shine Multispeciality Hospital", specialty="Multi-Specialty Hospital",
+        dict(name="Shine Multispeciality Hospital", specialty="Multi-Specialty Hospital",
                address="Behind Utsav Bhog Dhaba, Kanpur Road, Junab Ganj, Lucknow, Uttar Pradesh, 226401",
                phone="N/A", latitude=26.6852, longitude=80.7936),
-        Doctor(name="Surya Hospital & Trauma Center", specialty="Hospital & Trauma Care",
+        dict(name="Surya Hospital & Trauma Center", specialty="Hospital & Trauma Care",
                address="Sector - I, L.D.A. Colony, Near Khazana Market, Kanpur Road Scheme (Aashiana), Lucknow, 226012",
                phone="0522-4074044", latitude=26.7934, longitude=80.9080)
     ]
-    db.session.bulk_save_objects(doctors)
+    db.session.bulk_insert_mappings(Doctor, doctors)
+    _build_article_search_index()
     
     db.session.commit()
     return True
 
+_ARTICLE_FTS_TRIGGERS = (
+    "CREATE TRIGGER IF NOT EXISTS article_fts_ai AFTER INSERT ON article BEGIN "
+    "INSERT INTO article_fts(rowid, title, content_md, category) "
+    "VALUES (new.id, new.title, new.content_md, new.category); END",
+    "CREATE TRIGGER IF NOT EXISTS article_fts_ad AFTER DELETE ON article BEGIN "
+    "INSERT INTO article_fts(article_fts, rowid, title, content_md, category) "
+    "VALUES ('delete', old.id, old.title, old.content_md, old.category); END",
+    "CREATE TRIGGER IF NOT EXISTS article_fts_au AFTER UPDATE ON article BEGIN "
+    "INSERT INTO article_fts(article_fts, rowid, title, content_md, category) "
+    "VALUES ('delete', old.id, old.title, old.content_md, old.category); "
+    "INSERT INTO article_fts(rowid, title, content_md, category) "
+    "VALUES (new.id, new.title, new.content_md, new.category); END",
+)
+
+def _build_article_search_index():
+    """(Re)builds the SQLite FTS5 index over articles, ready for a library search endpoint."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    try:
+        # External-content table: the text stays in `article`, FTS5 only stores the index
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS article_fts "
+            "USING fts5(title, content_md, category, content='article', content_rowid='id')"
+        ))
+        # FTS5 doesn't follow its content table by itself; these keep it in step with article edits
+        for trigger in _ARTICLE_FTS_TRIGGERS:
+            db.session.execute(text(trigger))
+        db.session.execute(text("INSERT INTO article_fts(article_fts) VALUES('rebuild')"))
+    except OperationalError as e:  # SQLite built without FTS5
+        print(f'Skipping article search index: {e}')
+
+def _ensure_indexes():
+    """Creates any model index missing from an existing database (create_all skips existing tables)."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def _ensure_columns():
+    """Adds nullable model columns missing from an existing table (create_all never alters tables).
+
+    E.g. article.content_html on a database created before that column existed.
+    """
+    inspector = inspect(db.engine)
+    quote = db.engine.dialect.identifier_preparer.quote
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"))
+
 @app.cli.command('init-db')
 def init_db_command():
     """Clears existing data and creates new tables, adding sample articles and doctors."""
-    with app.app_context():
-        db.drop_all() 
-        db.create_all()
-        _seed_data()
-        print('Initialized local database.')
+    # Flask's CLI already runs commands inside an app context
+    db.drop_all() 
+    db.create_all()
+    _seed_data()
+    print('Initialized local database.')
+
+
+# --- Template Precompilation ---
+def precompile_templates():
+    """Compiles every template into Jinja's cache.
+
+    Called from gunicorn's master when preloading, so forked workers start with the
+    compiled templates instead of each compiling them on first render.
+    """
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
 
 
 # --- User Loader for Flask-Login ---
+# Column values of recently loaded users, so Flask-Login doesn't SELECT the user row on
+# every request. Per-process, and entries expire after a minute.
+_user_cache = TTLCache(maxsize=10_000, ttl=60)
+_user_cache_lock = threading.Lock()
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    with _user_cache_lock:
+        data = _user_cache.get(user_id)
+    if data is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            with _user_cache_lock:
+                _user_cache[user_id] = {attr.key: getattr(user, attr.key) for attr in User.__mapper__.column_attrs}
+        return user
+    # Rebuild the row from the cache and attach it to this request's session without a SELECT
+    user = User(**data)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+# --- JSON Helpers ---
+# orjson is much faster than the stdlib json Flask uses, which matters for long chat histories.
+def orjson_response(obj, status=200):
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
+
+def client_has_etag(etag):
+    """True if the request's If-None-Match already names this version.
+
+    Flask-Compress rewrites the ETag of compressed responses to "<etag>:<encoding>",
+    so the validator a browser sends back may carry that suffix.
+    """
+    sent = request.if_none_match
+    return sent.contains_weak(etag) or any(tag.split(':', 1)[0] == etag for tag in sent.as_set(include_weak=True))
+
+def conditional_response(response, etag):
+    """Sets a strong ETag and turns the response into a 304 if the client already has this version."""
+    response.set_etag(etag)
+    if client_has_etag(etag):
+        response.status_code = 304
+    return response
+
+# Changes whenever any template does, so page ETags never outlive the markup they were made for
+TEMPLATE_VERSION = hashlib.blake2b(
+    b''.join(app.jinja_env.loader.get_source(app.jinja_env, name)[0].encode('utf-8')
+             for name in sorted(app.jinja_env.list_templates())),
+    digest_size=8,
+).hexdigest()
+
+def conditional_page(render, *content):
+    """Returns render()'s page with an ETag, or a 304 without rendering if the browser's copy is current.
+
+    The ETag covers `content`, the viewer (the layout shows their name) and the templates.
+    Requests with pending flash messages always render, since a 304 would hide them.
+    """
+    if session.get('_flashes'):
+        return render()
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (TEMPLATE_VERSION, current_user.get_id(), current_user.name, *content):
+        digest.update(str(part).encode('utf-8') + b'\0')
+    etag = digest.hexdigest()
+    response = app.response_class(status=304) if client_has_etag(etag) else make_response(render())
+    response.set_etag(etag)
+    # Behind login and per-user, so only the browser may keep it, and it must revalidate each time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def read_json_body():
+    """Parses the request body with orjson; returns {} if it isn't a JSON object."""
+    try:
+        data = orjson.loads(request.get_data())
+    except orjson.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+# --- Time Helpers ---
+_HHMM = re.compile(r'[0-2]\d:[0-5]\d(?::[0-5]\d)?')
+
+def parse_clock_time(time_str):
+    """Parses a 24-hour HH:MM[:SS] string; returns None for anything else without raising."""
+    if not isinstance(time_str, str) or not _HHMM.fullmatch(time_str):
+        return None
+    try:
+        return time.fromisoformat(time_str)
+    except ValueError:  # e.g. "25:00" passes the shape check
+        return None
+
+def request_now():
+    """datetime.now() taken once per request, so every check in the request uses the same instant."""
+    if 'now' not in g:
+        g.now = datetime.now()
+    return g.now
+
+@app.template_global()
+def today_iso():
+    """Today's date as YYYY-MM-DD for templates (e.g. a date input's min), from the request's clock."""
+    return request_now().date().isoformat()
 
 # --- Main App Routes ---
 @app.route('/')
@@ -401,6 +770,27 @@ def signup():
 
     return redirect(url_for('landing', form='signup'))
 
+def password_needs_rehash(password_hash):
+    """True if the bcrypt hash ("$2b$<cost>$...") was made with a lower cost than BCRYPT_LOG_ROUNDS.
+
+    Only ever upgrades: hashes stored at a higher cost keep it even if the default is lowered.
+    """
+    try:
+        return int(password_hash.split('$')[2]) < app.config['BCRYPT_LOG_ROUNDS']
+    except (IndexError, ValueError):
+        return True
+
+def rehash_password(user, password):
+    """Re-hashes the password at the configured cost, so old hashes stop costing their original rounds."""
+    try:
+        user.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        db.session.commit()
+        with _user_cache_lock:
+            _user_cache.pop(user.id, None)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error re-hashing password: {e}")
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
@@ -412,7 +802,11 @@ def login():
         
         user = User.query.filter_by(email=email).first()
         
-        if user and bcrypt.check_password_hash(user.password_hash, password):
+        password_ok = bcrypt.check_password_hash(user.password_hash if user else DUMMY_PASSWORD_HASH, password or '')
+        if user and password_ok:
+            # Only possible right after a successful check, while the plaintext is at hand
+            if password_needs_rehash(user.password_hash):
+                rehash_password(user, password)
             login_user(user, remember=True)
             next_page = request.args.get('next')
             return redirect(next_page or url_for('dashboard'))
@@ -433,8 +827,10 @@ def logout():
 @app.route('/library')
 @login_required
 def library():
-    articles = Article.query.all()
-    return render_template('library.html', title='Health Library', articles=articles)
+    # The listing only shows titles and categories, so skip loading the article bodies
+    articles = Article.query.with_entities(Article.id, Article.title, Article.category).all()
+    return conditional_page(lambda: render_template('library.html', title='Health Library', articles=articles),
+                            *(tuple(article) for article in articles))
 
 @app.route('/article/<int:article_id>')
 @login_required
@@ -443,119 +839,525 @@ def article_detail(article_id):
     if not article:
         flash('Article not found.', 'danger')
         return redirect(url_for('library'))
-    return render_template('article_detail.html', title=article.title, article=article)
+    return conditional_page(lambda: render_template('article_detail.html', title=article.title, article=article),
+                            article.id, article.title, article.category, article.content_html)
 
 # --- Chat API Routes ---
+OPENROUTER_MODEL = "openai/gpt-oss-20b:free"
+AI_UNAVAILABLE_MESSAGE = "I'm sorry, I'm having trouble connecting to my brain right now. Please try again in a moment."
+# Appended to a streamed reply that was saved before it finished
+AI_INTERRUPTED_NOTE = "\n\n_(This reply was interrupted before it finished.)_"
+
+# The system prompt opens every message list, so it is serialized and hashed once here;
+# each request only hashes the history and new message on top of a copy of this state.
+_SYSTEM_PROMPT_DIGEST = hashlib.blake2b(json.dumps(dict(SYSTEM_PROMPT), sort_keys=True).encode(), digest_size=20)
+
+def _ai_cache_key(messages):
+    if messages and messages[0] is SYSTEM_PROMPT:
+        digest = _SYSTEM_PROMPT_DIGEST.copy()
+        messages = messages[1:]
+    else:
+        digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps(messages, sort_keys=True, default=dict).encode())
+    return "llm:" + digest.hexdigest()
+
+def get_cached_ai_response(messages):
+    key = _ai_cache_key(messages)
+    with _local_ai_cache_lock:
+        cached = _local_ai_cache.get(key)
+    if cached is not None or redis_client is None:
+        return cached
+    try:
+        cached = redis_client.get(key)
+    except redis.RedisError as e:
+        app.logger.warning(f"Error reading AI response cache: {e}")
+        return None
+    if cached is not None:
+        with _local_ai_cache_lock:
+            _local_ai_cache[key] = cached
+    return cached
+
+def cache_ai_response(messages, ai_response_content):
+    # Reminder actions aren't cached: replaying one would create the reminder again
+    if not ai_response_content or ai_response_content.lstrip().startswith('{'):
+        return
+    key = _ai_cache_key(messages)
+    with _local_ai_cache_lock:
+        _local_ai_cache[key] = ai_response_content
+    if redis_client is None:
+        return
+    try:
+        redis_client.setex(key, AI_CACHE_TTL_SECONDS, ai_response_content)
+    except redis.RedisError as e:
+        app.logger.warning(f"Error writing AI response cache: {e}")
+
+# Identical requests that arrive while one is already waiting on OpenRouter share that
+# call's answer instead of sending their own. Only exact duplicates are merged; different
+# conversations are never combined into one upstream prompt.
+_inflight_calls = {}
+_inflight_lock = threading.Lock()
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+def _join_or_start_call(key):
+    """Returns (call, is_leader). Only the leader talks to OpenRouter."""
+    with _inflight_lock:
+        call = _inflight_calls.get(key)
+        if call is not None:
+            return call, False
+        call = _InFlightCall()
+        _inflight_calls[key] = call
+        return call, True
+
+def _finish_call(key, call, result):
+    with _inflight_lock:
+        _inflight_calls.pop(key, None)
+    call.result = result
+    call.done.set()
+
+def _wait_for_call(call):
+    """Waits for the leader's answer; None means it failed and the caller should ask itself."""
+    call.done.wait(OPENROUTER_TIMEOUT_SECONDS)
+    return call.result
+
+# Caps concurrent OpenRouter calls, so a burst queues here briefly instead of tripping
+# OpenRouter's rate limit (429s plus retries are slower than waiting). The cap is per
+# worker process: the whole deployment allows workers x this many calls at once. It
+# defaults to half of gunicorn's threads per worker; at or above the thread count it
+# could never make anyone wait.
+OPENROUTER_MAX_CONCURRENCY = int(os.environ.get(
+    'OPENROUTER_MAX_CONCURRENCY', max(1, int(os.environ.get('GUNICORN_THREADS', 8)) // 2)))
+_openrouter_slots = threading.BoundedSemaphore(OPENROUTER_MAX_CONCURRENCY)
+
+@contextmanager
+def openrouter_slot():
+    if not _openrouter_slots.acquire(timeout=OPENROUTER_TIMEOUT_SECONDS):
+        raise RuntimeError("Timed out waiting for a free OpenRouter slot")
+    try:
+        yield
+    finally:
+        _openrouter_slots.release()
+
 def get_openrouter_response(messages):
+    cached = get_cached_ai_response(messages)
+    if cached is not None:
+        return cached
+    client = get_openrouter_client()
+    if client is None:
+        app.logger.error("OPENROUTER_API_KEY is not set; cannot contact OpenRouter.")
+        return AI_UNAVAILABLE_MESSAGE
+
+    key = _ai_cache_key(messages)
+    call, is_leader = _join_or_start_call(key)
+    if not is_leader:
+        shared = _wait_for_call(call)
+        if shared is not None:
+            return shared
+
+    ai_response_content = None
     try:
-        completion = client.chat.completions.create(
-            model="openai/gpt-oss-20b:free", 
-            messages=messages,
-            max_tokens=1024,
-        )
-        return completion.choices[0].message.content
+        with openrouter_slot():
+            completion = client.chat.completions.create(
+                model=OPENROUTER_MODEL, 
+                messages=messages,
+                max_tokens=1024,
+                extra_body=OPENROUTER_EXTRA_BODY,
+            )
+        ai_response_content = completion.choices[0].message.content
+        cache_ai_response(messages, ai_response_content)
+        return ai_response_content
     except Exception as e:
         app.logger.error(f"Error contacting OpenRouter: {e}")
-        return "I'm sorry, I'm having trouble connecting to my brain right now. Please try again in a moment."
+        return AI_UNAVAILABLE_MESSAGE
+    finally:
+        if is_leader:
+            _finish_call(key, call, ai_response_content)
+
+def stream_openrouter_response(messages):
+    """Yields the AI reply piece by piece as OpenRouter generates it.
+
+    An error before anything was yielded becomes AI_UNAVAILABLE_MESSAGE; one partway
+    through is re-raised, so the caller doesn't take the partial reply for a whole one.
+    """
+    cached = get_cached_ai_response(messages)
+    if cached is not None:
+        yield cached
+        return
+    client = get_openrouter_client()
+    if client is None:
+        app.logger.error("OPENROUTER_API_KEY is not set; cannot contact OpenRouter.")
+        yield AI_UNAVAILABLE_MESSAGE
+        return
+
+    key = _ai_cache_key(messages)
+    call, is_leader = _join_or_start_call(key)
+    if not is_leader:
+        shared = _wait_for_call(call)
+        if shared is not None:
+            yield shared
+            return
+
+    parts = []
+    sent = False
+    ai_response_content = None
+    try:
+        with ExitStack() as slot:
+            slot.enter_context(openrouter_slot())
+            stream = client.chat.completions.create(
+                model=OPENROUTER_MODEL,
+                messages=messages,
+                max_tokens=1024,
+                stream=True,
+                extra_body=OPENROUTER_EXTRA_BODY,
+            )
+            # Each piece is passed on only once the next has arrived, so the slot can be freed
+            # as soon as OpenRouter is done, before the last piece waits on the client
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if parts:
+                        yield parts[-1]
+                        sent = True
+                    parts.append(chunk.choices[0].delta.content)
+            slot.close()
+            ai_response_content = ''.join(parts)
+            cache_ai_response(messages, ai_response_content)
+            if parts:
+                yield parts[-1]
+    except Exception as e:
+        app.logger.error(f"Error streaming from OpenRouter: {e}")
+        if sent:
+            raise
+        yield AI_UNAVAILABLE_MESSAGE
+    finally:
+        if is_leader:
+            _finish_call(key, call, ai_response_content)
+
+# How many of the user's most recent messages are sent to the model as context
+CHAT_CONTEXT_MESSAGES = 10
+# Older messages are dropped once the history sent to the model passes this many tokens
+CHAT_CONTEXT_TOKEN_BUDGET = 2000
+
+def get_recent_history(user_id):
+    """Returns the user's most recent messages, oldest first.
+
+    Read from the database on every turn rather than cached in the process: gunicorn runs
+    several workers, and a per-worker copy would miss turns (or a cleared chat) handled by another.
+    """
+    # Newest N rows via the (user_id, id) index, returned oldest-first in the same statement
+    latest = (
+        select(ChatHistory.id, ChatHistory.role, ChatHistory.content)
+        .where(ChatHistory.user_id == user_id)
+        .order_by(ChatHistory.id.desc())
+        .limit(CHAT_CONTEXT_MESSAGES)
+        .subquery()
+    )
+    rows = db.session.execute(select(latest.c.role, latest.c.content).order_by(latest.c.id)).all()
+    return [{"role": role, "content": content} for role, content in rows]
+
+def save_chat_turn(user_id, user_message_content, ai_response_content):
+    """Inserts the user and assistant rows in one Core INSERT; the caller commits."""
+    db.session.execute(insert(ChatHistory), [
+        {"role": "user", "content": user_message_content, "user_id": user_id},
+        {"role": "assistant", "content": ai_response_content, "user_id": user_id},
+    ])
+
+# Stays None (token counts use the length estimate) until load_token_encoding() succeeds
+_token_encoding = None
+TOKEN_ENCODING_LOAD_TIMEOUT_SECONDS = 10
+
+def load_token_encoding(timeout=TOKEN_ENCODING_LOAD_TIMEOUT_SECONDS):
+    """Loads the tiktoken encoding on a background thread, waiting at most `timeout` seconds.
+
+    On a fresh host tiktoken downloads the encoding file with no timeout of its own, so this
+    runs from gunicorn's hooks rather than at import or in a request; if the download stalls,
+    startup carries on and token counts keep using the length estimate.
+    """
+    if tiktoken is None or _token_encoding is not None:
+        return
+
+    def load():
+        global _token_encoding
+        try:
+            # gpt-oss uses the o200k tokenizer
+            _token_encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            app.logger.warning(f"tiktoken encoding unavailable, estimating tokens from length: {e}")
+            return
+        # Drop counts made with the estimate while the encoding was loading
+        estimate_tokens.cache_clear()
+
+    loader = threading.Thread(target=load, name='tiktoken-load', daemon=True)
+    loader.start()
+    loader.join(timeout)
+
+# History messages are the same strings request after request, so each is counted once
+@lru_cache(maxsize=4096)
+def estimate_tokens(text):
+    if _token_encoding is not None:
+        return len(_token_encoding.encode_ordinary(text))
+    # Roughly 4 characters per token for English text; close enough for budgeting.
+    return len(text) // 4 + 1
+
+def fit_history_to_budget(history, budget=CHAT_CONTEXT_TOKEN_BUDGET):
+    """Keeps the most recent messages that fit the token budget, truncating the one that crosses it."""
+    kept = []
+    used = 0
+    for msg in reversed(history):
+        cost = estimate_tokens(msg["content"])
+        if used + cost > budget:
+            # Keep the start of the boundary message rather than dropping it outright,
+            # so one long reply doesn't push all earlier context out of the prompt
+            remaining_chars = len(msg["content"]) * (budget - used) // cost
+            if remaining_chars > 0:
+                kept.append({**msg, "content": msg["content"][:remaining_chars]})
+            break
+        used += cost
+        kept.append(msg)
+    kept.reverse()
+    return kept
+
+def build_chat_messages(user_message_content, history):
+    """Builds the OpenRouter message list: system prompt, recent history, then the new message."""
+    messages = [SYSTEM_PROMPT]
+    messages.extend(fit_history_to_budget(history))
+    messages.append({"role": "user", "content": user_message_content})
+    return messages
+
+def create_reminder_reply(med_name, dosage, time_str):
+    """Adds a reminder to the session (the caller commits it with the chat turn) and returns the reply to show."""
+    if dosage == "None":
+        dosage = None
+
+    reminder_time_obj = parse_clock_time(time_str)
+
+    if not med_name or not time_str:
+        return "I'm sorry, I missed some of those details. Could you please provide the medicine name and time again?"
+    if reminder_time_obj is None:
+        return f"I'm sorry, I couldn't understand the time '{time_str}'. Please provide it in 24-hour HH:MM format (e.g., 08:00 for 8 AM or 20:00 for 8 PM)."
+
+    try:
+        new_reminder = Reminder(
+            medicine_name=med_name,
+            dosage=dosage,
+            reminder_time=reminder_time_obj,
+            user_id=current_user.id
+        )
+        db.session.add(new_reminder)
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error creating reminder from AI: {e}")
+        return "I'm sorry, I had trouble saving that reminder. Please try again or use the manual form on the 'Reminders' page."
+
+    time_friendly = reminder_time_obj.strftime('%I:%M %p')
+    dosage_text = f" ({dosage})" if dosage else ""
+    return f"OK, I've set a reminder for {med_name}{dosage_text} at {time_friendly}. You can see all your reminders on the 'Reminders' page."
+
+def handle_reminder_action(ai_response_content):
+    """If the AI replied with a create_reminder action, adds the reminder and returns the text to show instead."""
+    # Nearly every reply is plain chat text; skip json.loads (and its exception) for those.
+    # The substring test comes first because it doesn't copy the reply the way lstrip() does.
+    if not ai_response_content or '"create_reminder"' not in ai_response_content:
+        return ai_response_content
+    candidate = ai_response_content.lstrip()
+    if not candidate.startswith('{'):
+        return ai_response_content
+
+    try:
+        data = json.loads(candidate)
+        if data.get('action') == 'create_reminder':
+            ai_response_content = create_reminder_reply(data.get('medicine'), data.get('dosage'), data.get('time'))
+    except (json.JSONDecodeError, TypeError, AttributeError):
+        pass
+
+    return ai_response_content
+
+# Messages like "remind me to take aspirin 500 mg at 8:30 pm" are handled without the model.
+# Only the whole message matching counts; anything looser goes to the LLM as before.
+_LOCAL_REMINDER = re.compile(
+    r'\s*(?:please\s+)?remind me to take (?P<med>\w+)(?:\s+(?P<dose>\d+\s*mg))?'
+    r'\s+at\s+(?P<h>\d{1,2})(?:[:.](?P<m>\d{2}))?\s*(?P<ap>am|pm)?[\s.!]*',
+    re.IGNORECASE,
+)
+# Words that refer back to the conversation rather than name a medicine
+_NOT_A_MEDICINE = frozenset({
+    'it', 'them', 'that', 'this', 'these', 'those', 'one', 'mine', 'my',
+    'pill', 'pills', 'tablet', 'tablets', 'capsule', 'capsules', 'dose', 'doses',
+    'med', 'meds', 'medicine', 'medicines', 'medication', 'medications',
+})
+
+def local_reminder_reply(user_message_content, history):
+    """Creates the reminder for an unambiguous reminder request and returns the reply, or None to ask the model.
+
+    Falls through to the model whenever the conversation could change the meaning:
+    the medicine is a pronoun or generic word, the time could be AM or PM, or a
+    reminder is already being discussed in the recent history.
+    """
+    match = _LOCAL_REMINDER.fullmatch(user_message_content)
+    if match is None or match['med'].lower() in _NOT_A_MEDICINE:
+        return None
+    hour, minute = int(match['h']), int(match['m'] or 0)
+    meridiem = (match['ap'] or '').lower()
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem == 'pm' else 0)
+    elif match['m'] is None or hour < 13:
+        return None  # "at 8" or "at 9:00" could be morning or evening; let the model ask
+    if hour > 23 or minute > 59:
+        return None
+    if any('remind' in msg["content"].lower() for msg in history):
+        return None  # mid-conversation about a reminder; the model has the context
+    return create_reminder_reply(match['med'], match['dose'], f"{hour:02d}:{minute:02d}")
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_PAGE_MAX = 200
 
 @app.route('/get_history')
 @login_required
 def get_history():
-    history = ChatHistory.query.filter_by(user_id=current_user.id).order_by(ChatHistory.timestamp).all()
-    history_list = [{"role": msg.role, "content": msg.content} for msg in history]
-    return jsonify(history_list)
+    """Returns the newest `limit` messages, oldest first. Pass `before_id` to page further back."""
+    limit = max(1, min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), HISTORY_PAGE_MAX))
+    before_id = request.args.get('before_id', type=int)
+
+    # Plain column tuples rather than ORM objects; nothing here needs the model instances
+    query = select(ChatHistory.id, ChatHistory.role, ChatHistory.content).where(ChatHistory.user_id == current_user.id)
+    if before_id is not None:
+        query = query.where(ChatHistory.id < before_id)
+    rows = db.session.execute(query.order_by(ChatHistory.id.desc()).limit(limit)).all()
+    rows.reverse()
+
+    history_list = [{"id": msg_id, "role": role, "content": content} for msg_id, role, content in rows]
+    response = orjson_response(history_list)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    # Hash of the body rather than the newest id: SQLite can reuse ids after a chat is cleared
+    return conditional_response(response, hashlib.blake2b(response.get_data(), digest_size=16).hexdigest())
 
 @app.route('/ask', methods=['POST'])
 @login_required
 def ask():
-    user_message_content = request.json.get('message')
+    user_message_content = read_json_body().get('message')
     if not user_message_content:
         return jsonify({"error": "No message provided"}), 400
+    if not isinstance(user_message_content, str):
+        return jsonify({"error": "Message must be a string"}), 400
 
-    user_message = ChatHistory(role='user', content=user_message_content, author=current_user)
-    db.session.add(user_message)
-    
-    system_prompt = {
-        "role": "system",
-        "content": (
-            "You have two tasks. First, be a helpful medical AI. Second, be a reminder assistant."
-            "\n\n**TASK 1: Medical AI**"
-            "\n- **YOUR MOST IMPORTANT RULE:** You MUST refuse to answer any questions that are not related to health, medicine, wellness, or symptoms. "
-            "If the user asks about anything else, you must politely decline."
-            "\n- Your persona: You are 'Medullose AI'. You are NOT a doctor and must NEVER provide a diagnosis. "
-            "Always end your (health-related) response with a clear, friendly disclaimer: 'Please remember, I am an AI, not a medical professional. It's always best to consult a doctor for a proper diagnosis.'"
-            
-            "\n\n**TASK 2: Reminder Assistant**"
-            "\n- If the user asks to set a medicine reminder, your goal is to collect three pieces of information: `medicine_name`, `dosage` (optional), and `time` (in 24-hour HH:MM format)."
-            "\n- Ask for any missing information."
-            "\n- Once you have the required info, you **MUST** respond *only* with a special JSON-like string and nothing else."
-            "\n- **JSON Format:** `{\"action\": \"create_reminder\", \"medicine\": \"...\", \"dosage\": \"...\", \"time\": \"HH:MM\"}`"
-        )
-    }
-    
-    recent_history = ChatHistory.query.filter_by(user_id=current_user.id).order_by(ChatHistory.timestamp.desc()).limit(10).all()
-    recent_history.reverse() 
-    
-    messages = [system_prompt] + [{"role": msg.role, "content": msg.content} for msg in recent_history]
-    messages.append({"role": "user", "content": user_message_content})
+    history = get_recent_history(current_user.id)
+    ai_response_content = local_reminder_reply(user_message_content, history)
+    if ai_response_content is None:
+        messages = build_chat_messages(user_message_content, history)
+        ai_response_content = get_openrouter_response(messages)
+        ai_response_content = handle_reminder_action(ai_response_content)
 
-    ai_response_content = get_openrouter_response(messages)
-    
-    try:
-        data = json.loads(ai_response_content)
-        
-        if data.get('action') == 'create_reminder':
-            med_name = data.get('medicine')
-            dosage = data.get('dosage')
-            time_str = data.get('time')
-
-            if dosage == "None":
-                dosage = None 
-            
-            if not med_name or not time_str:
-                ai_response_content = "I'm sorry, I missed some of those details. Could you please provide the medicine name and time again?"
-            else:
-                try:
-                    reminder_time_obj = time.fromisoformat(time_str)
-                    
-                    new_reminder = Reminder(
-                        medicine_name=med_name,
-                        dosage=dosage,
-                        reminder_time=reminder_time_obj,
-                        author=current_user
-                    )
-                    db.session.add(new_reminder)
-                    
-                    time_friendly = reminder_time_obj.strftime('%I:%M %p') 
-                    dosage_text = f" ({dosage})" if dosage else ""
-                    ai_response_content = f"OK, I've set a reminder for {med_name}{dosage_text} at {time_friendly}. You can see all your reminders on the 'Reminders' page."
-
-                except ValueError:
-                    ai_response_content = f"I'm sorry, I couldn't understand the time '{time_str}'. Please provide it in 24-hour HH:MM format (e.g., 08:00 for 8 AM or 20:00 for 8 PM)."
-                except Exception as e:
-                    db.session.rollback()
-                    app.logger.error(f"Error creating reminder from AI: {e}")
-                    ai_response_content = "I'm sorry, I had trouble saving that reminder. Please try again or use the manual form on the 'Reminders' page."
-
-    except (json.JSONDecodeError, TypeError):
-        pass
-    
-    ai_message = ChatHistory(role='assistant', content=ai_response_content, author=current_user)
-    
     try:
+        save_chat_turn(current_user.id, user_message_content, ai_response_content)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"Error saving chat history: {e}")
         return jsonify({"error": "Could not save chat history"}), 500
 
-    return jsonify({"answer": ai_response_content})
+    # The saved turn, so clients can append it locally instead of re-fetching /get_history
+    return jsonify({
+        "answer": ai_response_content,
+        "history_delta": [
+            {"role": "user", "content": user_message_content},
+            {"role": "assistant", "content": ai_response_content},
+        ],
+    })
+
+@app.route('/ask_stream', methods=['POST'])
+@login_required
+def ask_stream():
+    """Same as /ask, but streams the reply to the browser as server-sent events."""
+    user_message_content = read_json_body().get('message')
+    if not user_message_content:
+        return jsonify({"error": "No message provided"}), 400
+    if not isinstance(user_message_content, str):
+        return jsonify({"error": "Message must be a string"}), 400
+
+    history = get_recent_history(current_user.id)
+    local_reply = local_reminder_reply(user_message_content, history)
+    messages = build_chat_messages(user_message_content, history) if local_reply is None else None
+
+    def sse(payload):
+        # Called once per streamed chunk, so encode with orjson like the other JSON responses
+        return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+    def save_turn(ai_response_content):
+        """Commits the turn, and any reminder the reply created, in one transaction."""
+        try:
+            save_chat_turn(current_user.id, user_message_content, ai_response_content)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error saving chat history: {e}")
+            return False
+        return True
+
+    def generate():
+        parts = []
+        saved = None
+        if local_reply is not None:
+            # Handled locally; there is nothing to stream, only the final answer
+            parts.append(local_reply)
+            saved = save_turn(local_reply)
+            yield sse({"done": True, "answer": local_reply} if saved else {"error": "Could not save chat history"})
+            return
+        # A reply starting with '{' may be a reminder action, so it is held back
+        # until complete instead of being shown to the user as raw JSON.
+        holding_back = None
+
+        def save_partial_reply():
+            """Saves a reply that stopped early, marked as such; held-back action JSON is never saved."""
+            partial = ''.join(parts)
+            if holding_back or not partial.strip():
+                return False
+            return save_turn(partial + AI_INTERRUPTED_NOTE)
+
+        try:
+            try:
+                for delta in stream_openrouter_response(messages):
+                    parts.append(delta)
+                    if holding_back is None:
+                        so_far = ''.join(parts).lstrip()
+                        if not so_far:
+                            continue
+                        holding_back = so_far.startswith('{')
+                        if not holding_back:
+                            yield sse({"delta": ''.join(parts)})
+                    elif not holding_back:
+                        yield sse({"delta": delta})
+            except Exception:
+                # Already logged by stream_openrouter_response
+                saved = save_partial_reply()
+                yield sse({"error": "The reply was interrupted. Please try again."})
+                return
+
+            ai_response_content = handle_reminder_action(''.join(parts))
+            # Commit before the final event, so a reminder the reply confirms has really been saved
+            saved = save_turn(ai_response_content)
+            if saved:
+                yield sse({"done": True, "answer": ai_response_content})
+            else:
+                yield sse({"error": "Could not save chat history"})
+        finally:
+            # The client disconnected mid-stream; keep what it was shown
+            if saved is None:
+                save_partial_reply()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/clear_chat', methods=['POST'])
 @login_required
 def clear_chat():
     try:
-        ChatHistory.query.filter_by(user_id=current_user.id).delete()
+        # One DELETE; skip matching the deleted rows against objects in the session
+        ChatHistory.query.filter_by(user_id=current_user.id).delete(synchronize_session=False)
         db.session.commit()
         return jsonify({"status": "success", "message": "Chat history cleared."})
     except Exception as e:
@@ -572,8 +1374,16 @@ def reminders():
 @app.route('/api/get_reminders', methods=['GET'])
 @login_required
 def get_reminders():
-    reminders = Reminder.query.filter_by(user_id=current_user.id).order_by(Reminder.reminder_time).all()
-    return jsonify([r.to_dict() for r in reminders])
+    # Plain column tuples, serialized the same way as Reminder.to_dict(), without building ORM objects
+    rows = db.session.execute(
+        select(Reminder.id, Reminder.medicine_name, Reminder.dosage, Reminder.reminder_time)
+        .where(Reminder.user_id == current_user.id)
+        .order_by(Reminder.reminder_time)
+    ).all()
+    return orjson_response([
+        {'id': reminder_id, 'medicine_name': medicine_name, 'dosage': dosage, 'reminder_time': reminder_time.strftime('%I:%M %p')}
+        for reminder_id, medicine_name, dosage, reminder_time in rows
+    ])
 
 @app.route('/api/add_reminder', methods=['POST'])
 @login_required
@@ -587,21 +1397,21 @@ def add_reminder():
         if not med_name or not time_str:
             return jsonify({"error": "Medicine name and time are required."}), 400
         
-        reminder_time_obj = time.fromisoformat(time_str)
+        reminder_time_obj = parse_clock_time(time_str)
+        if reminder_time_obj is None:
+            return jsonify({"error": "Invalid time format. Please use HH:MM (24-hour)."}), 400
         
         new_reminder = Reminder(
             medicine_name=med_name,
             dosage=dosage,
             reminder_time=reminder_time_obj,
-            author=current_user
+            user_id=current_user.id
         )
         db.session.add(new_reminder)
         db.session.commit()
         
         return jsonify(new_reminder.to_dict()), 201
         
-    except ValueError:
-        return jsonify({"error": "Invalid time format. Please use HH:MM (24-hour)."}), 400
     except Exception as e:
         db.session.rollback()
         app.logger.error(f"Error adding reminder: {e}")
@@ -611,13 +1421,11 @@ def add_reminder():
 @login_required
 def delete_reminder(reminder_id):
     try:
-        reminder = Reminder.query.get_or_404(reminder_id)
-        
-        if reminder.user_id != current_user.id:
-            return jsonify({"error": "Unauthorized"}), 403
-            
-        db.session.delete(reminder)
+        # Ownership is part of the DELETE, so the row is never loaded into Python
+        deleted = Reminder.query.filter_by(id=reminder_id, user_id=current_user.id).delete(synchronize_session=False)
         db.session.commit()
+        if not deleted:
+            return jsonify({"error": "Reminder not found."}), 404
         return jsonify({"status": "success", "message": "Reminder deleted."})
         
     except Exception as e:
@@ -631,16 +1439,49 @@ def delete_reminder(reminder_id):
 def find_doctors():
     return render_template('find_doctors.html', title="Find a Doctor")
 
+_doctors_cache = None  # (json bytes, etag) for /api/get_doctors
+
 @app.route('/api/get_doctors', methods=['GET'])
 @login_required
 def get_doctors():
-    doctors = Doctor.query.all()
-    return jsonify([d.to_dict() for d in doctors])
+    # The directory only changes when the database is seeded, so serialize it once per
+    # worker and let browsers revalidate with the ETag instead of re-downloading it.
+    global _doctors_cache
+    cached = _doctors_cache
+    if cached is None:
+        doctors = Doctor.query.options(raiseload('*')).all()
+        body = orjson.dumps([d.to_dict() for d in doctors])
+        cached = (body, hashlib.blake2b(body, digest_size=8).hexdigest())
+        if doctors:  # don't pin an empty list from before the first seed
+            _doctors_cache = cached
+    body, etag = cached
+    response = app.response_class(body, mimetype='application/json')
+    response.cache_control.private = True
+    response.cache_control.max_age = 300
+    return conditional_response(response, etag)
+
+# Doctor rows only change when the database is seeded, so the booking page reads them
+# from a short-lived per-process cache instead of SELECTing on every GET and POST.
+_doctor_cache = TTLCache(maxsize=1024, ttl=300)
+_doctor_cache_lock = threading.Lock()
+
+def get_doctor(doctor_id):
+    """Returns the doctor's fields as a dict, or None if there's no such doctor."""
+    with _doctor_cache_lock:
+        doctor = _doctor_cache.get(doctor_id)
+    if doctor is None:
+        row = db.session.get(Doctor, doctor_id)
+        if row is None:
+            return None
+        doctor = row.to_dict()
+        with _doctor_cache_lock:
+            _doctor_cache[doctor_id] = doctor
+    return doctor
 
 @app.route('/book/<int:doctor_id>', methods=['GET', 'POST'])
 @login_required
 def book_appointment(doctor_id):
-    doctor = db.session.get(Doctor, doctor_id)
+    doctor = get_doctor(doctor_id)
     if not doctor:
         flash('Doctor not found.', 'danger')
         return redirect(url_for('find_doctors'))
@@ -655,21 +1496,24 @@ def book_appointment(doctor_id):
             return redirect(url_for('book_appointment', doctor_id=doctor_id))
 
         try:
-            appointment_dt_str = f"{date_str} {time_str}"
-            appointment_datetime = datetime.strptime(appointment_dt_str, '%Y-%m-%d %H:%M')
-
-            if appointment_datetime < datetime.now():
+            # fromisoformat avoids strptime's per-call locale lookups; the time goes through
+            # the HH:MM check so offsets like "10:00+05:30" can't produce an aware datetime
+            appointment_time = parse_clock_time(time_str)
+            if appointment_time is None:
+                raise ValueError(f"Invalid appointment time: {time_str!r}")
+            appointment_datetime = datetime.combine(date.fromisoformat(date_str), appointment_time)
+
+            if appointment_datetime < request_now():
                 flash('You cannot book an appointment in the past.', 'danger')
                 return redirect(url_for('book_appointment', doctor_id=doctor_id))
 
-            new_appointment = Appointment(
-                appointment_datetime=appointment_datetime,
-                reason=reason,
-                patient=current_user,
-                doctor=doctor
-            )
-            
-            db.session.add(new_appointment)
+            # Core INSERT: nothing reads the new row back, so skip building and tracking an ORM object
+            db.session.execute(insert(Appointment), [{
+                "appointment_datetime": appointment_datetime,
+                "reason": reason,
+                "user_id": current_user.id,
+                "doctor_id": doctor_id,
+            }])
             db.session.commit()
             
             flash('Your appointment has been successfully booked!', 'success')
@@ -682,33 +1526,46 @@ def book_appointment(doctor_id):
             app.logger.error(f"Error booking appointment: {e}")
             flash('An error occurred while booking. Please try again.', 'danger')
 
-    min_date = date.today().isoformat()
-    return render_template('book_appointment.html', title=f"Book with {doctor.name}", doctor=doctor, min_date=min_date)
+    return render_template('book_appointment.html', title=f"Book with {doctor['name']}", doctor=doctor)
+
 
+APPOINTMENTS_PAGE_SIZE = 25
 
 @app.route('/my_appointments')
 @login_required
 def my_appointments():
-    appointments = Appointment.query.filter_by(user_id=current_user.id).order_by(Appointment.appointment_datetime.asc()).all()
-    return render_template('my_appointments.html', title="My Appointments", appointments=appointments)
+    # The page shows each appointment's doctor; load them in the same query instead of one SELECT per row.
+    # Paginated so a long booking history doesn't all get loaded and rendered at once.
+    pagination = (
+        Appointment.query.options(joinedload(Appointment.doctor))
+        .filter_by(user_id=current_user.id)
+        .order_by(Appointment.appointment_datetime.asc())
+        .paginate(page=request.args.get('page', 1, type=int), per_page=APPOINTMENTS_PAGE_SIZE, error_out=False)
+    )
+    return render_template('my_appointments.html', title="My Appointments",
+                           appointments=pagination.items, pagination=pagination)
 
 @app.route('/cancel_appointment/<int:appointment_id>', methods=['POST'])
 @login_required
 def cancel_appointment(appointment_id):
     try:
-        appointment = Appointment.query.get_or_404(appointment_id)
-        
-        if appointment.user_id != current_user.id:
-            flash('You are not authorized to cancel this appointment.', 'danger')
-            return redirect(url_for('my_appointments'))
-        
-        if appointment.appointment_datetime < datetime.now():
-            flash('You cannot cancel an appointment that has already passed.', 'warning')
-            return redirect(url_for('my_appointments'))
-            
-        db.session.delete(appointment)
+        # Ownership and the "not yet passed" rule are part of the DELETE itself,
+        # so the common case is one statement with no row loaded into Python
+        deleted = Appointment.query.filter(
+            Appointment.id == appointment_id,
+            Appointment.user_id == current_user.id,
+            Appointment.appointment_datetime >= request_now(),
+        ).delete(synchronize_session=False)
         db.session.commit()
-        flash('Your appointment has been cancelled.', 'success')
+
+        if deleted:
+            flash('Your appointment has been cancelled.', 'success')
+        elif db.session.execute(
+            select(Appointment.id).where(Appointment.id == appointment_id, Appointment.user_id == current_user.id)
+        ).first():
+            flash('You cannot cancel an appointment that has already passed.', 'warning')
+        else:
+            flash('Appointment not found.', 'danger')
         
     except Exception as e:
         db.session.rollback()
@@ -718,21 +1575,42 @@ def cancel_appointment(appointment_id):
     return redirect(url_for('my_appointments'))
 
 # --- NEW: Secret route to initialize the database on Render ---
+INIT_DB_KEY = os.environ.get('INIT_DB_KEY', 'medullose-admin-12345') # Key updated to 'medullose'
+INIT_DB_COOLDOWN_SECONDS = 60
+_init_db_lock = threading.Lock()
+_init_db_last_run = None
+
 @app.route('/admin/super-secret-init-db')
 def secret_init_db():
     # This is a simple security measure. 
-    secret_key = request.args.get('key')
-    if secret_key == 'medullose-admin-12345': # Key updated to 'medullose'
+    secret_key = request.args.get('key') or ''
+    # compare_digest takes the same time wherever the key differs, so it can't be guessed byte by byte
+    if not hmac.compare_digest(secret_key.encode('utf-8'), INIT_DB_KEY.encode('utf-8')):
+        return "Not authorized.", 403
+
+    global _init_db_last_run
+    # One run at a time, and at most once per cooldown, so the key can't be used to tie up workers with DDL
+    if not _init_db_lock.acquire(blocking=False):
+        return "Initialization already in progress.", 429
+    try:
+        if _init_db_last_run is not None and monotonic() - _init_db_last_run < INIT_DB_COOLDOWN_SECONDS:
+            return "Initialization ran recently; try again later.", 429
+        _init_db_last_run = monotonic()
+        # The request already has an app context, so no nested app.app_context() is needed
         try:
-            with app.app_context():
-                db.create_all() # First, ensure all tables exist
-                _seed_data() # Then, seed the data (it has a check)
+            db.create_all() # First, ensure all tables exist
+            _ensure_columns()
+            _ensure_indexes()
+            _seed_data() # Then, seed the data (it has a check)
             return "DATABASE INITIALIZED/SEEDED SUCCESSFULLY."
-        except Exception as e:
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            app.logger.error(f"Error initializing database: {e}")
             return f"An error occurred: {e}"
-    else:
-        return "Not authorized.", 403
+    finally:
+        _init_db_lock.release()
 
 # --- Main Run ---
 if __name__ == '__main__':
+    load_token_encoding()
     app.run(debug=True)
\ No newline at end of file
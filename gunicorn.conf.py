@@ -1,9 +1,31 @@
 # Gunicorn configuration file
 import multiprocessing
+import os
 
 # Server settings
 bind = "0.0.0.0:10000"  # Render will connect to this port
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"  # <-- THIS IS THE FIX
+# Threads supply the concurrency for slow OpenRouter calls, so one process per core is
+# enough; each extra process only duplicates the caches and connection pools in memory.
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# /ask spends seconds waiting on OpenRouter; threads let one worker serve other
+# requests during that wait instead of blocking the whole process. app.py caps concurrent
+# OpenRouter calls per worker at half of these unless OPENROUTER_MAX_CONCURRENCY is set.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
 preload_app = True
 
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is imported, so workers inherit compiled
+    # templates and, if it loads within its timeout, the tiktoken encoding
+    from app import load_token_encoding, precompile_templates
+    precompile_templates()
+    load_token_encoding()
+
+
+def post_fork(server, worker):
+    # Each worker opens its own OpenRouter connection before taking requests
+    from app import load_token_encoding, warm_up_openrouter
+    warm_up_openrouter()
+    # If the master's load hadn't finished, keep trying in this worker without delaying it
+    load_token_encoding(timeout=0)